@@ -1,29 +1,194 @@
 import os
+import json
+import hashlib
+from datetime import datetime
 from dotenv import load_dotenv
 
+import redis
+
 from flask import Flask, render_template, request, flash, redirect, session, g
+from flask import make_response
 from flask_debugtoolbar import DebugToolbarExtension
+from flask_session import Session
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import or_
+from sqlalchemy import Integer, func, literal, select, true
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+from sqlalchemy.orm import aliased, joinedload, make_transient_to_detached
 from werkzeug.exceptions import Unauthorized
+from werkzeug.local import LocalProxy
 
 from forms import UserAddForm, LoginForm, MessageForm, CSRFProtectedForm, UserEditForm
-from models import db, connect_db, User, Message, DEFAULT_HEADER_IMAGE_URL, DEFAULT_IMAGE_URL
+from models import db, connect_db, User, Message, Follow, Like, DEFAULT_HEADER_IMAGE_URL, DEFAULT_IMAGE_URL
 
 load_dotenv()
 
 CURR_USER_KEY = "curr_user"
 
+# Endpoints whose responses browsers may keep and revalidate (via ETag or
+# Last-Modified); everything else is sent as no-store
+REVALIDATED_ENDPOINTS = {"static", "show_message"}
+
+# Number of users/messages shown per page on the follow and likes lists
+PAGE_SIZE = 20
+
 app = Flask(__name__)
 
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
 app.config['SQLALCHEMY_ECHO'] = False
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ['SECRET_KEY']
-toolbar = DebugToolbarExtension(app)
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+# One CSRF token for the life of the session (it's kept in the session, and
+# only the methods below check it), so forms in long-open tabs still submit
+app.config['WTF_CSRF_TIME_LIMIT'] = None
+app.config['WTF_CSRF_METHODS'] = ['POST', 'PUT', 'PATCH', 'DELETE']
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': int(os.environ.get('SQLALCHEMY_POOL_SIZE', 20)),
+    'max_overflow': int(os.environ.get('SQLALCHEMY_MAX_OVERFLOW', 20)),
+    'pool_timeout': int(os.environ.get('SQLALCHEMY_POOL_TIMEOUT', 20)),
+    'pool_recycle': int(os.environ.get('SQLALCHEMY_POOL_RECYCLE', 3600)),
+    'pool_pre_ping': os.environ.get('SQLALCHEMY_POOL_PRE_PING', '1') == '1',
+}
+
+# The toolbar hooks into every response, so only load it when debugging
+if app.debug:
+    toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
 
+# Redis is optional: without REDIS_URL, every lookup goes straight to the DB
+redis_client = (redis.Redis.from_url(os.environ['REDIS_URL'])
+                if os.environ.get('REDIS_URL') else None)
+
+# Keep session data in Redis; the cookie only carries the session id
+if redis_client:
+    app.config['SESSION_TYPE'] = 'redis'
+    app.config['SESSION_REDIS'] = redis_client
+    app.config['SESSION_USE_SIGNER'] = True
+    app.config['SESSION_PERMANENT'] = False
+    Session(app)
+
+USER_CACHE_TTL = 60
+FOLLOWING_CACHE_TTL = 60 * 60
+MESSAGE_CACHE_TTL = 24 * 60 * 60
+
+
+##############################################################################
+# Caching
+
+
+def get_user(user_id):
+    """Get user by id, going through the Redis cache when we have one.
+
+    Only column values are cached (never the password hash); relationships
+    are loaded from the DB as usual when accessed.
+    """
+
+    key = f"user:{user_id}"
+
+    if redis_client:
+        raw = redis_client.get(key)
+
+        if raw is not None:
+            user = User(**json.loads(raw))
+            make_transient_to_detached(user)
+            return db.session.merge(user, load=False)
+
+    user = db.session.get(User, user_id)
+
+    if user and redis_client:
+        data = {col.key: getattr(user, col.key)
+                for col in User.__table__.columns
+                if col.key != "password"}
+        redis_client.setex(key, USER_CACHE_TTL, json.dumps(data))
+
+    return user
+
+
+def invalidate_user(user_id):
+    """Drop cached copy of user, if any."""
+
+    if redis_client:
+        redis_client.delete(f"user:{user_id}")
+
+
+def get_following_ids(user_id):
+    """Get list of ids of users that this user is following.
+
+    Cached as a Redis set, rebuilt from the DB on a miss. The set always
+    holds a 0 (not a valid user id) so that following nobody is still
+    cached, rather than looking like a miss.
+    """
+
+    key = f"following:{user_id}"
+
+    if redis_client:
+        cached = redis_client.smembers(key)
+
+        if cached:
+            return [int(followed_id) for followed_id in cached if int(followed_id)]
+
+    following_ids = db.session.scalars(
+        select(Follow.user_being_followed_id)
+        .filter_by(user_following_id=user_id)
+    ).all()
+
+    if redis_client:
+        pipe = redis_client.pipeline()
+        pipe.sadd(key, 0, *following_ids)
+        pipe.expire(key, FOLLOWING_CACHE_TTL)
+        pipe.execute()
+
+    return following_ids
+
+
+def invalidate_following_ids(user_id):
+    """Drop cached following ids of user, if any."""
+
+    if redis_client:
+        redis_client.delete(f"following:{user_id}")
+
+
+def get_message_or_404(message_id):
+    """Get message by id or 404, going through the Redis cache if we have one.
+
+    Message text never changes, so entries only go away on delete.
+    """
+
+    key = f"message:{message_id}"
+
+    if redis_client:
+        raw = redis_client.get(key)
+
+        if raw is not None:
+            data = json.loads(raw)
+            data["timestamp"] = datetime.fromisoformat(data["timestamp"])
+
+            msg = Message(**data)
+            make_transient_to_detached(msg)
+            return db.session.merge(msg, load=False)
+
+    msg = db.get_or_404(Message, message_id)
+
+    if redis_client:
+        data = {
+            "id": msg.id,
+            "text": msg.text,
+            "timestamp": msg.timestamp.isoformat(),
+            "user_id": msg.user_id,
+        }
+        redis_client.setex(key, MESSAGE_CACHE_TTL, json.dumps(data))
+
+    return msg
+
+
+def invalidate_messages(*message_ids):
+    """Drop cached copies of messages, if any."""
+
+    if redis_client and message_ids:
+        redis_client.delete(*(f"message:{message_id}" for message_id in message_ids))
+
 
 ##############################################################################
 # User signup/login/logout
@@ -35,12 +200,24 @@ def add_user_and_csrf_to_g():
        Sets global csrf_form field to our CSRF protection form"""
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = get_user(session[CURR_USER_KEY])
 
     else:
         g.user = None
 
-    g.csrf_form = CSRFProtectedForm()
+    # Only built if a template or route actually uses it. connect_db pushes
+    # an app context, so `g` outlives the request: drop the last request's form
+    g.pop("_csrf_form", None)
+    g.csrf_form = LocalProxy(get_csrf_form)
+
+
+def get_csrf_form():
+    """Get this request's CSRF protection form, creating it on first use."""
+
+    if "_csrf_form" not in g:
+        g._csrf_form = CSRFProtectedForm()
+
+    return g._csrf_form
 
 
 def do_login(user):
@@ -48,6 +225,10 @@ def do_login(user):
 
     session[CURR_USER_KEY] = user.id
 
+    if redis_client:
+        # warm the cache the homepage is about to read
+        get_following_ids(user.id)
+
 
 def do_logout():
     """Log out user."""
@@ -144,6 +325,44 @@ def logout():
 ##############################################################################
 # General user routes:
 
+def get_page(query, id_column):
+    """Get one page of `query` results, highest `id_column` first.
+
+    Pages are keyed on the last id seen (the `before_id` query param) rather
+    than an OFFSET, so later pages cost no more than the first.
+
+    Returns (items, before_id for the next page or None if this is the last).
+    """
+
+    before_id = request.args.get('before_id', type=int)
+
+    if before_id:
+        query = query.filter(id_column < before_id)
+
+    items = query.order_by(id_column.desc()).limit(PAGE_SIZE).all()
+    next_before_id = items[-1].id if len(items) == PAGE_SIZE else None
+
+    return items, next_before_id
+
+
+def get_liked_ids(user_id, messages):
+    """Get set of ids of `messages` this user has liked, in one query.
+
+    Pages showing many messages check membership in this set, rather than
+    running a has_liked query per message.
+    """
+
+    message_ids = [msg.id for msg in messages]
+
+    if not message_ids:
+        return set()
+
+    return set(db.session.scalars(
+        select(Like.message_id)
+        .where(Like.user_id == user_id, Like.message_id.in_(message_ids))
+    ))
+
+
 @app.get('/users')
 def list_users():
     """Page with listing of users.
@@ -160,9 +379,17 @@ def list_users():
     if not search:
         users = User.query.all()
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        users = (User
+                 .query
+                 .filter(User.username.ilike(f"%{search}%"))
+                 .order_by(func.similarity(User.username, search).desc())
+                 .all())
 
-    return render_template('users/index.html', users=users)
+    return render_template(
+        'users/index.html',
+        users=users,
+        following_ids=set(get_following_ids(g.user.id)),
+    )
 
 
 @app.get('/users/<int:user_id>')
@@ -173,9 +400,13 @@ def show_user(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
+    user = db.get_or_404(User, user_id)
 
-    return render_template('users/show.html', user=user)
+    return render_template(
+        'users/show.html',
+        user=user,
+        liked_ids=get_liked_ids(g.user.id, user.messages),
+    )
 
 
 @app.get('/users/<int:user_id>/following')
@@ -186,8 +417,22 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    user = db.get_or_404(User, user_id)
+
+    following, next_before_id = get_page(
+        User.query
+        .join(Follow, Follow.user_being_followed_id == User.id)
+        .filter(Follow.user_following_id == user.id),
+        User.id,
+    )
+
+    return render_template(
+        'users/following.html',
+        user=user,
+        following=following,
+        following_ids=set(get_following_ids(g.user.id)),
+        next_before_id=next_before_id,
+    )
 
 
 @app.get('/users/<int:user_id>/followers')
@@ -198,8 +443,22 @@ def show_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    user = db.get_or_404(User, user_id)
+
+    followers, next_before_id = get_page(
+        User.query
+        .join(Follow, Follow.user_following_id == User.id)
+        .filter(Follow.user_being_followed_id == user.id),
+        User.id,
+    )
+
+    return render_template(
+        'users/followers.html',
+        user=user,
+        followers=followers,
+        following_ids=set(get_following_ids(g.user.id)),
+        next_before_id=next_before_id,
+    )
 
 
 @app.post('/users/follow/<int:follow_id>')
@@ -218,15 +477,25 @@ def start_following(follow_id):
     elif not form.validate_on_submit():
         raise Unauthorized()
 
-    followed_user = User.query.get_or_404(follow_id)
+    followed_user = db.get_or_404(User, follow_id)
+
+    # the insert is skipped (and nothing returned) if the follow exists
+    followed = db.session.execute(
+        pg_insert(Follow)
+        .values(
+            user_being_followed_id=followed_user.id,
+            user_following_id=g.user.id,
+        )
+        .on_conflict_do_nothing()
+        .returning(Follow.user_following_id)
+    ).first()
+    db.session.commit()
 
-    if followed_user in g.user.following:
+    if not followed:
         flash("You are already following that user.", "danger")
         return redirect("/")
 
-
-    g.user.following.append(followed_user)
-    db.session.commit()
+    invalidate_following_ids(g.user.id)
 
     return redirect(request.referrer)
 
@@ -247,14 +516,18 @@ def stop_following(follow_id):
     elif not form.validate_on_submit():
         raise Unauthorized()
 
-    followed_user = User.query.get_or_404(follow_id)
+    followed_user = db.get_or_404(User, follow_id)
 
-    if followed_user not in g.user.following:
+    if not g.user.is_following(followed_user):
         flash("You are not following that user.", "danger")
         return redirect("/")
 
-    g.user.following.remove(followed_user)
+    Follow.query.filter_by(
+        user_being_followed_id=followed_user.id,
+        user_following_id=g.user.id,
+    ).delete()
     db.session.commit()
+    invalidate_following_ids(g.user.id)
 
     return redirect(request.referrer)
 
@@ -281,6 +554,7 @@ def edit_profile():
         g.user.bio = form.bio.data or g.user.bio
 
         db.session.commit()
+        invalidate_user(g.user.id)
 
         flash("User profile successfully updated!", "success")
 
@@ -304,8 +578,20 @@ def delete_user():
 
     do_logout()
 
-    User.query.filter_by(id=g.user.id).delete()
+    user_id = g.user.id
+
+    # their messages go too (via cascade), so they must leave the cache
+    message_ids = (db.session.scalars(
+        select(Message.id).filter_by(user_id=user_id)).all()
+        if redis_client else [])
+
+    # one DELETE; the DB's ON DELETE CASCADE removes their messages,
+    # follows and likes
+    User.query.filter_by(id=user_id).delete(synchronize_session=False)
     db.session.commit()
+    invalidate_user(user_id)
+    invalidate_following_ids(user_id)
+    invalidate_messages(*message_ids)
     flash("Account successfully deleted.","success")
     return redirect("/signup")
 
@@ -344,8 +630,35 @@ def show_message(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get_or_404(message_id)
-    return render_template('messages/show.html', message=msg)
+    msg = get_message_or_404(message_id)
+
+    # Besides the message, the page shows its author, the viewer's avatar
+    # and like/follow buttons, and the session's CSRF token in its forms,
+    # so all of those go into the ETag
+    csrf_token = session.get(app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token'))
+    liked = g.user.has_liked(msg)
+    following = g.user.is_following(msg.user)
+    etag = hashlib.md5(
+        f"{msg.id}:{msg.text}:{msg.user.username}:{msg.user.image_url}:"
+        f"{g.user.id}:{g.user.image_url}:{csrf_token}:{liked}:{following}"
+        .encode()
+    ).hexdigest()
+
+    # A 304 would leave pending flashes for some later page; render instead
+    if "_flashes" not in session and request.if_none_match.contains(etag):
+        response = make_response("", 304)
+    else:
+        response = make_response(render_template(
+            'messages/show.html',
+            message=msg,
+            liked=liked,
+            following=following,
+        ))
+
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 
 @app.post('/messages/<int:message_id>/delete')
@@ -357,7 +670,7 @@ def delete_message(message_id):
     """
 
     form = g.csrf_form
-    msg = Message.query.get_or_404(message_id)
+    msg = get_message_or_404(message_id)
 
     if not g.user or g.user.id != msg.user_id:
         flash("Access unauthorized.", "danger")
@@ -368,6 +681,7 @@ def delete_message(message_id):
 
     db.session.delete(msg)
     db.session.commit()
+    invalidate_messages(message_id)
 
     return redirect(f"/users/{g.user.id}")
 
@@ -382,27 +696,33 @@ def like_message(message_id):
     # include hidden input tag with form with 'referrer' information
 
     form = g.csrf_form
-    msg = Message.query.get_or_404(message_id)
+    msg = get_message_or_404(message_id)
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    elif msg in g.user.liked_messages:
-        flash("You have already liked this message", "danger")
-        return redirect(request.referrer)
-
-    elif msg.user.id == g.user.id:
+    elif msg.user_id == g.user.id:
         flash("You can't like your own message","danger")
         return redirect(request.referrer)
 
     elif not form.validate_on_submit():
         raise Unauthorized()
 
-    g.user.liked_messages.append(msg)
+    # the insert is skipped (and nothing returned) if the like exists
+    liked = db.session.execute(
+        pg_insert(Like)
+        .values(user_id=g.user.id, message_id=msg.id)
+        .on_conflict_do_nothing()
+        .returning(Like.user_id)
+    ).first()
 
     db.session.commit()
 
+    if not liked:
+        flash("You have already liked this message", "danger")
+        return redirect(request.referrer)
+
     flash("You liked this warble!", "success")
 
     return redirect(request.referrer)
@@ -412,21 +732,21 @@ def unlike_message(message_id):
     """Unlike a message.
     """
 
-    msg = Message.query.get_or_404(message_id)
+    msg = get_message_or_404(message_id)
     form = g.csrf_form
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    elif msg not in g.user.liked_messages:
+    elif not g.user.has_liked(msg):
         flash("This message is not in your likes", "danger")
         return redirect(request.referrer)
 
     elif not form.validate_on_submit():
         raise Unauthorized()
 
-    g.user.liked_messages.remove(msg)
+    Like.query.filter_by(user_id=g.user.id, message_id=msg.id).delete()
 
     db.session.commit()
 
@@ -443,9 +763,23 @@ def show_user_likes(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
+    user = db.get_or_404(User, user_id)
+
+    messages, next_before_id = get_page(
+        Message.query
+        .options(joinedload(Message.user))
+        .join(Like)
+        .filter(Like.user_id == user.id),
+        Message.id,
+    )
 
-    return render_template('users/likes.html', user=user)
+    return render_template(
+        'users/likes.html',
+        user=user,
+        messages=messages,
+        liked_ids=get_liked_ids(g.user.id, messages),
+        next_before_id=next_before_id,
+    )
 
 
 
@@ -463,16 +797,40 @@ def homepage():
     """
 
     if g.user:
-        messages = (Message
-                    .query
-                    .filter(or_
-                        (Message.user_id.in_(user.id for user in g.user.following),
-                        (Message.user_id == g.user.id)))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-
-        return render_template('home.html', messages=messages)
+        # A set, as users can follow themselves; a repeated id would list
+        # their messages twice
+        user_ids = list({*get_following_ids(g.user.id), g.user.id})
+
+        # Take the 100 newest messages of *each* user (an index range scan
+        # on messages(user_id, timestamp DESC)) and keep the newest 100 of
+        # those, rather than sorting every message these users ever wrote.
+        authors = (func
+                   .unnest(literal(user_ids, ARRAY(Integer)))
+                   .table_valued("user_id")
+                   .render_derived())
+
+        latest = (select(Message)
+                  .where(Message.user_id == authors.c.user_id)
+                  .order_by(Message.timestamp.desc())
+                  .limit(100)
+                  .lateral())
+
+        latest_message = aliased(Message, latest)
+
+        messages = db.session.scalars(
+            select(latest_message)
+            .select_from(authors)
+            .join(latest, true())
+            .options(joinedload(latest_message.user))
+            .order_by(latest_message.timestamp.desc())
+            .limit(100)
+        ).all()
+
+        return render_template(
+            'home.html',
+            messages=messages,
+            liked_ids=get_liked_ids(g.user.id, messages),
+        )
 
     else:
         return render_template('home-anon.html')
@@ -480,7 +838,10 @@ def homepage():
 
 @app.after_request
 def add_header(response):
-    """Add non-caching headers on every request."""
+    """Add non-caching headers, except where the browser can revalidate."""
+
+    if request.endpoint in REVALIDATED_ENDPOINTS:
+        return response
 
     # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
     response.cache_control.no_store = True
@@ -0,0 +1,131 @@
+"""Shared pytest setup for the test modules."""
+
+import functools
+import os
+from types import SimpleNamespace
+
+import bcrypt
+import pytest
+
+from models import db, User, Follow
+from testing import RolledBackTransaction, create_tables
+
+# The suite runs against a local database in one process, so pooled
+# connections don't go stale; skip the liveness check on every checkout.
+# (Pool settings are read when the app is first imported by a test module)
+
+os.environ.setdefault('SQLALCHEMY_POOL_PRE_PING', '0')
+
+# Tests hash and check the same few passwords over and over. Use one salt
+# per cost (rather than a fresh random one each time) so equal inputs give
+# equal hashes, then memoize bcrypt itself: Flask-Bcrypt both hashes and
+# checks passwords with hashpw, so each (password, salt) is only run once
+
+bcrypt.gensalt = functools.lru_cache(maxsize=None)(bcrypt.gensalt)
+bcrypt.hashpw = functools.lru_cache(maxsize=None)(bcrypt.hashpw)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    """Create the tables once for the whole test run."""
+
+    create_tables()
+
+    yield
+
+    db.drop_all()
+
+
+@pytest.fixture(scope="module")
+def db_connection():
+    """Run a test module inside one transaction, rolled back at the end.
+
+    This is per module rather than per session: other modules insert the
+    same usernames, and would block on our uncommitted rows.
+    """
+
+    transaction = RolledBackTransaction()
+
+    yield transaction.connection
+
+    transaction.rollback()
+
+
+@pytest.fixture(scope="module")
+def users(db_connection):
+    """Create the test users once per module.
+
+    u2 and UNIQUE_USER_NAME_FOR_TEST follow u3, and u3 follows
+    UNIQUE_USER_NAME_FOR_TEST.
+
+    Returns their ids (u1_id ... u4_id), along with the URLs the view
+    tests request for them, built once here rather than in every test.
+    """
+
+    u1 = User.build("u1", "u1@email.com", "password", None)
+    u2 = User.build("u2", "u2@email.com", "password", None)
+    u3 = User.build("u3", "u3@email.com", "password", None)
+    u4 = User.build("UNIQUE_USER_NAME_FOR_TEST", "u4@email.com", "password", None)
+    db.session.bulk_save_objects([u1, u2, u3, u4], return_defaults=True)
+
+    db.session.bulk_save_objects([
+        Follow(user_being_followed_id=u3.id, user_following_id=u2.id),
+        Follow(user_being_followed_id=u3.id, user_following_id=u4.id),
+        Follow(user_being_followed_id=u4.id, user_following_id=u3.id),
+    ])
+
+    db.session.commit()
+
+    users = SimpleNamespace(
+        u1_id=u1.id,
+        u2_id=u2.id,
+        u3_id=u3.id,
+        u4_id=u4.id,
+        u1_url=f"/users/{u1.id}",
+        u1_followers_url=f"/users/{u1.id}/followers",
+        u1_following_url=f"/users/{u1.id}/following",
+        u2_followers_url=f"/users/{u2.id}/followers",
+        u2_following_url=f"/users/{u2.id}/following",
+        u3_followers_url=f"/users/{u3.id}/followers",
+        u3_following_url=f"/users/{u3.id}/following",
+        follow_u2_url=f"/users/follow/{u2.id}",
+        stop_following_u3_url=f"/users/stop-following/{u3.id}",
+        stop_following_u4_url=f"/users/stop-following/{u4.id}",
+    )
+    db.session.remove()
+
+    return users
+
+
+@pytest.fixture
+def db_savepoint(db_connection):
+    """Roll back everything a test writes, leaving the module's users."""
+
+    savepoint = db_connection.begin_nested()
+
+    yield
+
+    db.session.remove()
+    savepoint.rollback()
+
+
+@pytest.fixture(scope="session")
+def app_client():
+    """Flask test client, shared by the whole run."""
+
+    # Imported here, not at the top: test modules have to set DATABASE_URL
+    # before the app is first imported
+    from app import app
+
+    with app.test_client() as c:
+        yield c
+
+
+@pytest.fixture
+def client(app_client):
+    """The shared test client, with its session emptied (so logged out)."""
+
+    with app_client.session_transaction() as sess:
+        sess.clear()
+
+    return app_client
@@ -4,6 +4,7 @@ from datetime import datetime
 
 from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event, exists, func, lambda_stmt, select
 
 bcrypt = Bcrypt()
 db = SQLAlchemy()
@@ -35,6 +36,12 @@ class Follow(db.Model):
         primary_key=True,
     )
 
+    # The primary key covers lookups by followed user; this covers "who
+    # does this user follow"
+    __table_args__ = (
+        db.Index('ix_follows_user_following_id', user_following_id),
+    )
+
 
 class User(db.Model):
     """User in the system."""
@@ -87,37 +94,62 @@ class User(db.Model):
         nullable=False,
     )
 
-    messages = db.relationship('Message', backref="user")
+    # Trigram index, so user search's ILIKE '%term%' needn't scan the table
+    __table_args__ = (
+        db.Index(
+            'ix_users_username_trgm',
+            username,
+            postgresql_using='gin',
+            postgresql_ops={'username': 'gin_trgm_ops'},
+        ),
+    )
+
+    # The foreign keys all cascade on delete, so passive_deletes leaves
+    # that to the DB instead of loading each collection to clean it up
+
+    messages = db.relationship('Message', backref="user", passive_deletes=True)
 
     followers = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follow.user_being_followed_id == id),
         secondaryjoin=(Follow.user_following_id == id),
-        backref="following",
+        backref=db.backref("following", passive_deletes=True),
+        passive_deletes=True,
     )
 
-    liked_messages = db.relationship("Message", secondary="likes", backref="liked_by")
+    liked_messages = db.relationship(
+        "Message",
+        secondary="likes",
+        backref=db.backref("liked_by", passive_deletes=True),
+        passive_deletes=True,
+    )
 
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
     @classmethod
-    def signup(cls, username, email, password, image_url=DEFAULT_IMAGE_URL):
-        """Sign up user.
-
-        Hashes password and adds user to session.
-        """
+    def build(cls, username, email, password, image_url=DEFAULT_IMAGE_URL):
+        """Make (but don't add to session) a user with a hashed password."""
 
         hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
 
-        user = User(
+        return cls(
             username=username,
             email=email,
             password=hashed_pwd,
             image_url=image_url,
         )
 
+    @classmethod
+    def signup(cls, username, email, password, image_url=DEFAULT_IMAGE_URL):
+        """Sign up user.
+
+        Hashes password and adds user to session.
+        """
+
+        user = cls.build(username, email, password, image_url)
+
         db.session.add(user)
         return user
 
@@ -142,19 +174,53 @@ class User(db.Model):
 
         return False
 
+    # Single membership checks, for routes and the message/profile pages
+    # (list pages test id sets instead). As lambda statements, later calls
+    # skip building the SELECT and its cache key; they just bind the ids
+    # captured from the closure to the SQL compiled on the first call.
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [
-            user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        user_id, other_user_id = self.id, other_user.id
+
+        return db.session.scalar(lambda_stmt(
+            lambda: select(exists().where(
+                Follow.user_being_followed_id == user_id,
+                Follow.user_following_id == other_user_id,
+            ))
+        ))
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [
-            user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        user_id, other_user_id = self.id, other_user.id
+
+        return db.session.scalar(lambda_stmt(
+            lambda: select(exists().where(
+                Follow.user_being_followed_id == other_user_id,
+                Follow.user_following_id == user_id,
+            ))
+        ))
+
+    def has_liked(self, message):
+        """Has this user liked `message`?"""
+
+        user_id, message_id = self.id, message.id
+
+        return db.session.scalar(lambda_stmt(
+            lambda: select(exists().where(
+                Like.user_id == user_id,
+                Like.message_id == message_id,
+            ))
+        ))
+
+
+event.listen(
+    User.__table__,
+    'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'),
+)
 
 
 class Message(db.Model):
@@ -184,6 +250,12 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # Lets the homepage's "latest messages from these users" query walk
+    # the index instead of sorting every matching message
+    __table_args__ = (
+        db.Index('ix_messages_user_id_timestamp', user_id, timestamp.desc()),
+    )
+
 
 class Like(db.Model):
     """Connection of a user -> message."""
@@ -202,6 +274,53 @@ class Like(db.Model):
         primary_key=True,
     )
 
+    # The primary key covers lookups by message; this covers "what has
+    # this user liked"
+    __table_args__ = (
+        db.Index('ix_likes_user_id', user_id),
+    )
+
+
+# Counts shown on profile pages and the homepage. They're deferred as one
+# group, so reading any of them loads all four COUNT(*)s in a single query,
+# rather than loading the whole collections just to take their length.
+
+User.messages_count = db.column_property(
+    select(func.count(Message.id))
+    .where(Message.user_id == User.id)
+    .correlate_except(Message)
+    .scalar_subquery(),
+    deferred=True,
+    group="counts",
+)
+
+User.following_count = db.column_property(
+    select(func.count())
+    .where(Follow.user_following_id == User.id)
+    .correlate_except(Follow)
+    .scalar_subquery(),
+    deferred=True,
+    group="counts",
+)
+
+User.followers_count = db.column_property(
+    select(func.count())
+    .where(Follow.user_being_followed_id == User.id)
+    .correlate_except(Follow)
+    .scalar_subquery(),
+    deferred=True,
+    group="counts",
+)
+
+User.likes_count = db.column_property(
+    select(func.count())
+    .where(Like.user_id == User.id)
+    .correlate_except(Like)
+    .scalar_subquery(),
+    deferred=True,
+    group="counts",
+)
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -212,3 +331,4 @@ def connect_db(app):
     app.app_context().push()
     db.app = app
     db.init_app(app)
+    bcrypt.init_app(app)
@@ -10,7 +10,8 @@ from unittest import TestCase
 from datetime import datetime
 from sqlalchemy.exc import IntegrityError
 
-from models import db, Message, User
+from models import db, Message, User, Like
+from testing import RolledBackTransaction, create_tables
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -19,6 +20,10 @@ from models import db, Message, User
 
 os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
 
+# Tests don't need strong hashes; the minimum bcrypt cost keeps signups fast
+
+os.environ['BCRYPT_LOG_ROUNDS'] = "4"
+
 # Now we can import app
 
 from app import app, CURR_USER_KEY
@@ -30,11 +35,9 @@ app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
 
 # Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
+# once for all tests --- each test's changes are rolled back)
 
-db.drop_all()
-db.create_all()
+create_tables()
 
 # Don't have WTForms use CSRF at all, since it's a pain to test
 
@@ -43,7 +46,8 @@ app.config['WTF_CSRF_ENABLED'] = False
 
 class MessageModelTestCase(TestCase):
     def setUp(self):
-        User.query.delete()
+        # Run each test inside a transaction that tearDown rolls back
+        self.transaction = RolledBackTransaction()
 
         u1 = User.signup("u1", "u1@email.com", "password", None)
         db.session.flush()
@@ -56,7 +60,7 @@ class MessageModelTestCase(TestCase):
         self.m1_id = m1.id
 
     def tearDown(self):
-        db.session.rollback()
+        self.transaction.rollback()
 
     def test_successful_message(self):
         ''' Tests successful message creation'''
@@ -65,7 +69,7 @@ class MessageModelTestCase(TestCase):
         db.session.add(m2)
         db.session.commit()
 
-        self.assertIsNotNone(Message.query.get(m2.id))
+        self.assertIsNotNone(db.session.get(Message, m2.id))
         # could also check for text of message
         # could move timestamp instance check here
 
@@ -73,7 +77,7 @@ class MessageModelTestCase(TestCase):
         ''' Tests that timestamps are being added to messages
             by comparing the timestamps of two messages'''
 
-        m1 = Message.query.get(self.m1_id)
+        m1 = db.session.get(Message, self.m1_id)
         m2 = Message(text="m2-text", user_id=self.u1_id)
         db.session.add(m2)
         db.session.commit()
@@ -97,5 +101,18 @@ class MessageModelTestCase(TestCase):
             db.session.add(m2)
             db.session.commit()
 
+    def test_has_liked(self):
+        ''' Tests that has_liked reflects a like on a message'''
+
+        u1 = db.session.get(User, self.u1_id)
+        m1 = db.session.get(Message, self.m1_id)
+
+        self.assertFalse(u1.has_liked(m1))
+
+        db.session.add(Like(user_id=self.u1_id, message_id=self.m1_id))
+        db.session.commit()
+
+        self.assertTrue(u1.has_liked(m1))
+
     #TODO: test for liking messages
 
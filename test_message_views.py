@@ -8,7 +8,8 @@
 import os
 from unittest import TestCase
 
-from models import db, Message, User, Like
+from models import db, bcrypt, Message, User, Like
+from testing import RolledBackTransaction, create_tables
 from sqlalchemy import and_
 
 # BEFORE we import our app, let's set an environmental variable
@@ -18,6 +19,10 @@ from sqlalchemy import and_
 
 os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
 
+# Tests don't need strong hashes; the minimum bcrypt cost keeps signups fast
+
+os.environ['BCRYPT_LOG_ROUNDS'] = "4"
+
 # Now we can import app
 
 from app import app, CURR_USER_KEY
@@ -29,31 +34,32 @@ app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
 
 # Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
+# once for all tests --- each test's changes are rolled back)
 
-db.drop_all()
-db.create_all()
+create_tables()
 
 # Don't have WTForms use CSRF at all, since it's a pain to test
 
 app.config['WTF_CSRF_ENABLED'] = False
 
+# Every test user has the same password, so only hash it once
+
+PASSWORD_HASH = bcrypt.generate_password_hash("password").decode('UTF-8')
+
 
 class MessageBaseViewTestCase(TestCase):
     def setUp(self):
-        User.query.delete()
+        # Run each test inside a transaction that tearDown rolls back
+        self.transaction = RolledBackTransaction()
 
-        u1 = User.signup("u1", "u1@email.com", "password", None)
-        u2 = User.signup("u2", "u2@email.com", "password", None)
-
-        db.session.flush()
+        u1 = User(username="u1", email="u1@email.com", password=PASSWORD_HASH)
+        u2 = User(username="u2", email="u2@email.com", password=PASSWORD_HASH)
+        db.session.bulk_save_objects([u1, u2], return_defaults=True)
 
         m1 = Message(text="m1-text", user_id=u1.id)
         m2 = Message(text="m2-text", user_id=u2.id)
+        db.session.bulk_save_objects([m1, m2], return_defaults=True)
 
-
-        db.session.add_all([m1,m2])
         db.session.commit()
 
         self.u1_id = u1.id
@@ -62,7 +68,7 @@ class MessageBaseViewTestCase(TestCase):
         self.m2_id = m2.id
 
     def tearDown(self):
-        db.session.rollback()
+        self.transaction.rollback()
 
 class MessageAddDeleteViewTestCase(MessageBaseViewTestCase):
     """Tests message add and delete cases"""
@@ -111,7 +117,7 @@ class MessageAddDeleteViewTestCase(MessageBaseViewTestCase):
 
             self.assertEqual(resp.status_code, 302)
 
-            self.assertEqual(Message.query.get(self.m1_id),None)
+            self.assertEqual(db.session.get(Message, self.m1_id),None)
 
     def test_delete_message_when_logged_out(self):
         """Tests deleting message when logged out"""
@@ -121,7 +127,7 @@ class MessageAddDeleteViewTestCase(MessageBaseViewTestCase):
 
             self.assertEqual(resp.status_code, 302)
 
-            self.assertIsNotNone(Message.query.get(self.m1_id))
+            self.assertIsNotNone(db.session.get(Message, self.m1_id))
 
     def test_delete_other_users_message(self):
         ''' Tests deleting another users message '''
@@ -134,7 +140,7 @@ class MessageAddDeleteViewTestCase(MessageBaseViewTestCase):
 
             self.assertEqual(resp.status_code, 302)
 
-            self.assertIsNotNone(Message.query.get(self.m2_id))
+            self.assertIsNotNone(db.session.get(Message, self.m2_id))
 
     def test_show_message(self):
         ''' Test the display of an individual message'''
@@ -143,13 +149,60 @@ class MessageAddDeleteViewTestCase(MessageBaseViewTestCase):
             with c.session_transaction() as sess:
                 sess[CURR_USER_KEY] = self.u1_id
 
-            resp = c.get(f"/messages/{self.m1_id}",follow_redirects=True)
+            resp = c.get(f"/messages/{self.m1_id}")
             html = resp.get_data(as_text=True)
 
             self.assertEqual(resp.status_code, 200)
 
             self.assertIn("m1-text",html)
 
+    def test_show_message_not_modified(self):
+        ''' Tests that revisiting an unchanged message gets a 304'''
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get(f"/messages/{self.m2_id}")
+            etag = resp.headers["ETag"]
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotIn("no-store", resp.headers["Cache-Control"])
+
+            resp = c.get(f"/messages/{self.m2_id}",
+                         headers={"If-None-Match": etag})
+
+            self.assertEqual(resp.status_code, 304)
+
+            # liking it changes the page, so it must be sent again
+            c.post(f"/messages/{self.m2_id}/like")
+            resp = c.get(f"/messages/{self.m2_id}",
+                         headers={"If-None-Match": etag})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(f"/messages/{self.m2_id}/unlike",
+                          resp.get_data(as_text=True))
+
+    def test_show_message_with_flash_not_cached(self):
+        ''' Tests that a message page with a pending flash is sent again'''
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get(f"/messages/{self.m2_id}")
+            etag = resp.headers["ETag"]
+
+            # not liked, so this flashes and redirects back to the message
+            c.post(f"/messages/{self.m2_id}/unlike",
+                   headers={'referer': f"/messages/{self.m2_id}"})
+            resp = c.get(f"/messages/{self.m2_id}",
+                         headers={"If-None-Match": etag})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("This message is not in your likes",
+                          resp.get_data(as_text=True))
+
 class MessageLikeUnlikeViewTestCase(MessageBaseViewTestCase):
     """Tests message like and unlike cases"""
     #TODO: check user follower/following test patterns and move here
@@ -201,6 +254,34 @@ class MessageLikeUnlikeViewTestCase(MessageBaseViewTestCase):
                 0
             )
 
+    def test_like_already_liked_message(self):
+        ''' Tests that liking a message twice only stores one like'''
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.post(f"/messages/{self.m2_id}/like")
+            resp = c.post(
+                f"/messages/{self.m2_id}/like",
+                follow_redirects=True,
+                headers={'referer': '/'}
+            )
+
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("You have already liked this message", html)
+
+            self.assertEqual(
+                Like.query.filter(
+                and_(
+                    Like.message_id==self.m2_id,
+                    Like.user_id==self.u1_id)
+                ).count(),
+                1
+            )
+
     def test_unlike_message(self):
         ''' Tests the ability of a user to unlike a message'''
 
@@ -2,16 +2,15 @@
 
 # run these tests like:
 #
-#    python -m unittest test_user_model.py
+#    python -m pytest test_user_model.py
 
 
 import os
-from unittest import TestCase
-from flask_bcrypt import Bcrypt
+
+import pytest
 from sqlalchemy.exc import IntegrityError
 
-from models import db, User, Message, Follow
-from sqlalchemy import and_
+from models import db, User, Message
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -20,115 +19,135 @@ from sqlalchemy import and_
 
 os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
 
+# Tests don't need strong hashes; the minimum bcrypt cost keeps signups fast
+
+os.environ['BCRYPT_LOG_ROUNDS'] = "4"
+
 # Now we can import app
 
-from app import app, CURR_USER_KEY
+from app import app
 
 app.config['WTF_CSRF_ENABLED'] = False
 
-# Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
-bcrypt = Bcrypt()
-db.drop_all()
-db.create_all()
+# The tables are created once for the whole run by conftest.py; the users
+# are created once per module by the `users` fixture, and each test's
+# changes are rolled back
+
+pytestmark = pytest.mark.usefixtures("db_savepoint")
+
+
+def test_user_model(users):
+    u1 = db.session.get(User, users.u1_id)
+
+    # User should have no messages & no followers
+    assert len(u1.messages) == 0
+    assert len(u1.followers) == 0
+    assert len(u1.liked_messages) == 0
 
-class UserModelTestCase(TestCase):
-    def setUp(self):
-        User.query.delete()
 
-        u1 = User.signup("u1", "u1@email.com", "password", None)
-        u2 = User.signup("u2", "u2@email.com", "password", None)
-        u3 = User.signup("u3", "u3@email.com", "password", None)
+def test_user_signup(users):
+    ''' Tests signup of a valid user'''
 
-        u2.following.append(u3)
+    user = User.signup(username="test",
+                       email="test@email.com",
+                       password="password",
+                       image_url="image_url")
 
+    assert user.username == "test"
+    #TODO: bcrypt hash start with $2b$. check for that
+    assert user.password != "password"
+    assert user.email == "test@email.com"
+    assert user.image_url == "image_url"
+
+
+@pytest.mark.parametrize("username, email", [
+    # this username is signed up already in the fixture
+    ("u1", "test@email.com"),
+    # this email is signed up already in the fixture
+    ("test", "u1@email.com"),
+    # null username
+    (None, "testemail@email.com"),
+    # null email
+    ("test", None),
+])
+def test_invalid_user_signup(users, username, email):
+    ''' Tests signup with credentials used before or left null '''
+
+    with pytest.raises(IntegrityError):
+        User.signup(username, email, "password", None)
         db.session.commit()
 
-        self.u1_id = u1.id
-        self.u2_id = u2.id
-        self.u3_id = u3.id
 
-    def tearDown(self):
-        db.session.rollback()
+def test_user_authenticate_with_valid_username_password(users):
+    """Tests successful user authentication"""
+
+    u1 = db.session.get(User, users.u1_id)
+
+    authenticated_user = User.authenticate(u1.username, "password")
+
+    assert isinstance(authenticated_user, User)
+    #TODO: test that u1 == authenticated_user
 
-    def test_user_model(self):
-        u1 = User.query.get(self.u1_id)
 
-        # User should have no messages & no followers
-        self.assertEqual(len(u1.messages), 0)
-        self.assertEqual(len(u1.followers), 0)
-        self.assertEqual(len(u1.liked_messages), 0)
+def test_user_authenticate_with_invalid_username(users):
+    """Tests user authentication with invalid username"""
 
-    def test_user_signup(self):
-        ''' Tests signup of a valid user'''
+    authenticated_user = User.authenticate("not_a_username", "password")
 
-        user = User.signup(username="test",
-                           email="test@email.com",
-                           password="password",
-                           image_url="image_url")
+    assert not authenticated_user
 
-        self.assertEqual(user.username,"test")
-        #TODO: bcrypt hash start with $2b$. check for that
-        self.assertNotEqual(user.password,"password")
-        self.assertEqual(user.email,"test@email.com")
-        self.assertEqual(user.image_url,"image_url")
 
-    def test_duplicate_user_signup(self):
-        ''' Tests signup with credentials used before '''
+def test_user_authenticate_with_invalid_password(users):
+    """Tests user authentication with invalid password"""
 
-        with self.assertRaises(IntegrityError):
-            # this username is signed up already in the setup
-            User.signup("u1", "test@email.com", "password", None)
-            db.session.commit()
+    u1 = db.session.get(User, users.u1_id)
 
-        db.session.rollback()
-        #TODO: break into seperate tests, duplicate username and email
-        with self.assertRaises(IntegrityError):
-            # this email is signed up already in the setup
-            User.signup("test", "u1@email.com", "password", None)
-            db.session.commit()
+    authenticated_user = User.authenticate(u1.username, "not_the_right_pass")
 
+    assert not authenticated_user
 
 
-    def test_signup_user_with_null_values(self):
-        ''' Tests signing up a user with null values '''
+def test_is_following(users):
+    """Tests is_following for followed and not followed users"""
 
-        with self.assertRaises(IntegrityError):
-            # signing up with null username
-            User.signup(None, "testemail@email.com", "password", None)
-            db.session.commit()
+    u1 = db.session.get(User, users.u1_id)
+    u2 = db.session.get(User, users.u2_id)
+    u3 = db.session.get(User, users.u3_id)
 
-        db.session.rollback()
-        #TODO: break into seperate tests
-        with self.assertRaises(IntegrityError):
-            # signing up with null email
-            User.signup("test", None, "password", None)
-            db.session.commit()
+    assert u2.is_following(u3)
+    assert not u3.is_following(u2)
+    assert not u1.is_following(u3)
 
 
-    def test_user_authenticate_with_valid_username_password(self):
-        """Tests successful user authentication"""
+def test_is_followed_by(users):
+    """Tests is_followed_by for following and not following users"""
 
-        u1 = User.query.get(self.u1_id)
+    u1 = db.session.get(User, users.u1_id)
+    u2 = db.session.get(User, users.u2_id)
+    u3 = db.session.get(User, users.u3_id)
 
-        authenticated_user = User.authenticate(u1.username, "password")
+    assert u3.is_followed_by(u2)
+    assert not u2.is_followed_by(u3)
+    assert not u3.is_followed_by(u1)
 
-        self.assertIsInstance(authenticated_user, User)
-        #TODO: test that u1 == authenticated_user
 
-    def test_user_authenticate_with_invalid_username(self):
-        """Tests user authentication with invalid username"""
+def test_counts(users):
+    """Tests the message/follow/like counts on a user"""
 
-        authenticated_user = User.authenticate("not_a_username", "password")
+    u2 = db.session.get(User, users.u2_id)
+    u3 = db.session.get(User, users.u3_id)
 
-        self.assertFalse(authenticated_user)
+    assert u2.following_count == 1
 
-    def test_user_authenticate_with_invalid_password(self):
-        """Tests user authentication with invalid password"""
+    # reading one count loads the whole group
+    assert 'likes_count' in u2.__dict__
 
-        u1 = User.query.get(self.u1_id)
+    assert u2.followers_count == 0
+    assert u3.followers_count == 2
+    assert u3.messages_count == 0
+    assert u3.likes_count == 0
 
-        authenticated_user = User.authenticate(u1.username, "not_the_right_pass")
+    db.session.add(Message(text="m1-text", user_id=users.u3_id))
+    db.session.commit()
 
-        self.assertFalse(authenticated_user)
+    assert u3.messages_count == 1
@@ -2,14 +2,16 @@
 
 # run these tests like:
 #
-#    python -m unittest test_user_model.py
+#    python -m pytest test_user_views.py
 
 
 import os
-from unittest import TestCase
+import re
+
+import pytest
 
 from models import db, User, Message, Follow
-from sqlalchemy import and_
+from sqlalchemy import and_, or_
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -18,460 +20,519 @@ from sqlalchemy import and_
 
 os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
 
+# Tests don't need strong hashes; the minimum bcrypt cost keeps signups fast
+
+os.environ['BCRYPT_LOG_ROUNDS'] = "4"
+
 # Now we can import app
 
 from app import app, CURR_USER_KEY
 
 app.config['WTF_CSRF_ENABLED'] = False
 
-# Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
+# The tables are created once for the whole run by conftest.py; the users
+# are created once per module by the `users` fixture, and each test's
+# changes are rolled back
+
+pytestmark = pytest.mark.usefixtures("db_savepoint")
+
+
+##############################################################################
+# Follow cases
+
+def test_start_following(client, users):
+    ''' Tests attribute updating for user following another user'''
+
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.u1_id
+
+
+    response = client.post(
+        users.follow_u2_url,
+        headers={"referer" : "/"},
+    )
+
+    assert response.status_code == 302
+    assert response.headers["Location"] == "/"
+
+    #TODO: go to followers page and check for expected result
+
+    assert Follow.query.filter(
+        and_(Follow.user_being_followed_id==users.u2_id,
+            Follow.user_following_id==users.u1_id)).one_or_none() is not None
+
+
+def test_stop_following(client, users):
+    ''' Tests attribute updating for user unfollowing another user'''
+
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.u2_id
+
+    response = client.post(
+        users.stop_following_u3_url,
+        headers={
+            "referer" : "/"
+        },
+    )
+
+    assert response.status_code == 302
+    assert response.headers["Location"] == "/"
+
+    assert Follow.query.filter(
+        and_(
+            Follow.user_being_followed_id==users.u3_id,
+            Follow.user_following_id==users.u2_id)
+        ).count() == 0
+
+
+def test_follow_when_already_following(client, users):
+    ''' Tests a case where a user tries to follow someone they
+        already follow '''
+
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.u1_id
+
+
+    response = client.post(users.follow_u2_url, headers={
+            "referer" : "/"
+    })
+
+    response = client.post(users.follow_u2_url, headers={
+            "referer" : "/"
+    },follow_redirects=True)
+
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+
+    assert '<!-- HOMEPAGE :: FOR TESTING :: DO NOT MOVE -->' in html
+    assert "You are already following that user." in html
+
+    assert Follow.query.filter(
+        and_(Follow.user_being_followed_id==users.u2_id,
+            Follow.user_following_id==users.u1_id)).one_or_none() is not None
+
+
+def test_unfollow_when_not_following(client, users):
+    ''' Tests a case where a user tries to unfollow someone they
+        are not following '''
+
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.u2_id
+
+    response = client.post(
+        users.stop_following_u3_url,
+        headers={
+            "referer" : "/"
+        },
+    )
+
+    response = client.post(
+        users.stop_following_u3_url,
+        headers={
+            "referer" : "/"
+        },
+        follow_redirects=True
+    )
+
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+
+    assert '<!-- HOMEPAGE :: FOR TESTING :: DO NOT MOVE -->' in html
+    assert "You are not following that user." in html
+
+    assert Follow.query.filter(
+        and_(
+            Follow.user_being_followed_id==users.u3_id,
+            Follow.user_following_id==users.u2_id)
+        ).count() == 0
+
+
+def test_follower_page_updating(client, users):
+    ''' Tests that when a user follows someone, that user
+        shows up in the followed user's followers page'''
+    #TODO: consider combining these with above
+
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.u1_id
+
+    response = client.post(users.follow_u2_url, headers={
+            "referer" : "/"
+    })
+
+    response = client.get(users.u2_followers_url)
+    html = response.get_data(as_text=True)
+    assert "u1" in html
+
+
+def test_following_page_updating(client, users):
+    ''' Tests that when a user follows someone, that user
+        shows up in the user's following page'''
+
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.u1_id
+
+    response = client.post(users.follow_u2_url, headers={
+            "referer" : "/"
+    })
+
+    response = client.get(users.u1_following_url)
+    html = response.get_data(as_text=True)
+    assert "u2" in html
+
+
+def test_follower_page_updating_when_unfollowed(client, users):
+    ''' Tests that when a user unfollows someone, that user does not
+        show up in the followed user's followers page'''
+
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.u4_id
+
+    response = client.post(users.stop_following_u3_url)
+    response = client.get(users.u3_followers_url)
+
+    html = response.get_data(as_text=True)
+    assert "<p>@UNIQUE_USER_NAME_FOR_TEST</p>" not in html
+
+
+def test_following_page_updating_when_unfollowed(client, users):
+    ''' Tests that when a user unfollows someone, that user does not
+        show up in the previously followed user's following page'''
+
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.u3_id
+
+    response = client.post(users.stop_following_u4_url)
+    response = client.get(users.u3_following_url)
+
+    html = response.get_data(as_text=True)
+    assert "<p>@UNIQUE_USER_NAME_FOR_TEST</p>" not in html
+
+
+##############################################################################
+# Deleting a user
+
+def test_delete_user(client, users):
+    ''' Tests that deleting a user also removes their follows'''
+
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.u3_id
+
+    response = client.post("/users/delete", follow_redirects=True)
+
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert "Account successfully deleted." in html
+
+    assert User.query.filter_by(id=users.u3_id).one_or_none() is None
+    assert Follow.query.filter(
+        or_(Follow.user_being_followed_id==users.u3_id,
+            Follow.user_following_id==users.u3_id)).count() == 0
+
+
+##############################################################################
+# Logout
+
+def test_logout_with_csrf_token(client, users, monkeypatch):
+    ''' Tests that the CSRF token from a page GET is accepted on logout'''
+
+    monkeypatch.setitem(app.config, 'WTF_CSRF_ENABLED', True)
+
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.u1_id
+
+    html = client.get("/").get_data(as_text=True)
+    token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', html)
+
+    response = client.post("/logout", data={"csrf_token": token.group(1)})
+
+    assert response.status_code == 302
+
+    with client.session_transaction() as sess:
+        assert CURR_USER_KEY not in sess
+
+
+##############################################################################
+# Signup cases
+#TODO: move up before Follow test cases.
+
+def test_user_signup(client, users):
+    """Tests successful user signup"""
+
+    user_count = User.query.count()
+
+    response = client.post(
+        "/signup",
+        data={
+        "username": "test_user",
+        "password": "password",
+        "email": "test_user@gmail.com",
+        },
+    )
+
+    assert response.status_code == 302
+    assert response.headers["Location"] == "/"
+    assert User.query.count() == user_count + 1
+    assert User.query.filter_by(email="test_user@gmail.com").count() == 1
+    #TODO: check for signed in version of home page
+
+
+def test_user_signup_with_invalid_username(client, users):
+    """Tests user signup with already taken username"""
+
+    user_count = User.query.count()
+
+    response = client.post(
+        "/signup",
+        data={
+        "username": "u1",
+        "password": "password",
+        "email": "another_test_email@gmail.com",
+        },
+    )
+
+    html = response.get_data(as_text=True)
+    assert "Username or email already taken" in html
+    assert '<!-- SIGNUP PAGE :: FOR TESTING -->' in html
+    assert response.status_code == 200
+
+    db.session.rollback()
+    assert User.query.count() == user_count
+
+
+def test_user_signup_with_invalid_email(client, users):
+    """Tests user signup with already taken email"""
+
+    user_count = User.query.count()
+
+    response = client.post(
+        "/signup",
+        data={
+        "username": "test_user",
+        "password": "password",
+        "email": "u1@email.com",
+        },
+    )
+
+    html = response.get_data(as_text=True)
+    assert "Username or email already taken" in html
+    assert '<!-- SIGNUP PAGE :: FOR TESTING -->' in html
+    assert response.status_code == 200
+
+    db.session.rollback()
+    assert User.query.count() == user_count
+
+
+def test_user_signup_with_invalid_password(client, users):
+    """Tests user signup with invalid password"""
+
+    user_count = User.query.count()
+
+    response = client.post(
+        "/signup",
+        data={
+        "username": "test_user",
+        "password": "pa",
+        "email": "another_test_email@email.com",
+        },
+    )
+
+    html = response.get_data(as_text=True)
+    assert "Field must be between 6 and 50 characters long." in html
+    assert '<!-- SIGNUP PAGE :: FOR TESTING -->' in html
+
+    assert response.status_code == 200
+    assert User.query.count() == user_count
+
+
+def test_user_signup_with_null_input(client, users):
+    """Tests user signup with null input"""
 
-db.drop_all()
-db.create_all()
+    user_count = User.query.count()
 
+    response = client.post(
+        "/signup",
+        data={
+        "username": None,
+        "password": "password",
+        "email": "another_test_email@email.com",
+        },
+    )
 
-class UserViewTestCase(TestCase):
-    def setUp(self):
-        User.query.delete()
+    html = response.get_data(as_text=True)
+    assert "This field is required." in html
+    assert '<!-- SIGNUP PAGE :: FOR TESTING -->' in html
 
-        u1 = User.signup("u1", "u1@email.com", "password", None)
-        u2 = User.signup("u2", "u2@email.com", "password", None)
-        u3 = User.signup("u3", "u3@email.com", "password", None)
-        u4 = User.signup("UNIQUE_USER_NAME_FOR_TEST", "u4@email.com", "password", None)
+    assert response.status_code == 200
+    assert User.query.count() == user_count
 
-        u2.following.append(u3)
-        u4.following.append(u3)
-        u3.following.append(u4)
 
-        db.session.commit()
+##############################################################################
+# Access for both users and non-users
 
-        self.u1_id = u1.id
-        self.u2_id = u2.id
-        self.u3_id = u3.id
-        self.u4_id = u4.id
+def test_root_route(client, users):
+    """Tests root route while logged in"""
 
-    def tearDown(self):
-        db.session.rollback()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.u1_id
 
-class FollowTestCase(UserViewTestCase):
-    """Tests follow cases"""
+    response = client.get("/")
 
-    def test_start_following(self):
-        ''' Tests attribute updating for user following another user'''
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert 'HOMEPAGE :: FOR TESTING :: DO NOT MOVE' in html
+    #TODO: check for username
 
-        with app.test_client() as c:
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.u1_id
 
+def test_root_route_when_following_self(client, users):
+    """Tests that following yourself doesn't repeat your messages"""
 
-            response = c.post(
-                f'/users/follow/{self.u2_id}',
-                headers={"referer" : "/"},
-                follow_redirects=True
-            )
+    db.session.add_all([
+        Message(text="my-own-message", user_id=users.u1_id),
+        Follow(user_being_followed_id=users.u1_id,
+               user_following_id=users.u1_id),
+    ])
+    db.session.commit()
 
-            self.assertEqual(response.status_code,200)
-            html = response.get_data(as_text=True)
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.u1_id
 
-            #TODO: go to followers page and check for expected result
+    response = client.get("/")
 
-            self.assertIn('<!-- HOMEPAGE :: FOR TESTING :: DO NOT MOVE -->',html)
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert html.count("<p>my-own-message</p>") == 1
 
-            self.assertIsNotNone(
-                Follow.query.filter(
-                    and_(Follow.user_being_followed_id==self.u2_id,
-                        Follow.user_following_id==self.u1_id)).one_or_none()
-            )
 
-    def test_stop_following(self):
-        ''' Tests attribute updating for user unfollowing another user'''
+def test_root_route_while_logged_out(client, users):
+    """Tests root route while logged out"""
 
-        with app.test_client() as c:
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.u2_id
+    response = client.get("/")
 
-            response = c.post(
-                f'/users/stop-following/{self.u3_id}',
-                headers={
-                    "referer" : "/"
-                },
-                follow_redirects=True
-            )
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert 'ANON-HOMEPAGE :: FOR TESTING :: DO NOT MOVE' in html
 
-            self.assertEqual(response.status_code,200)
-            html = response.get_data(as_text=True)
 
-            self.assertIn('<!-- HOMEPAGE :: FOR TESTING :: DO NOT MOVE -->',html)
+def test_users_page(client, users):
+    """Tests showing user's page while logged in"""
+    #TODO: users_profile_page naming
 
-            self.assertEqual(
-                Follow.query.filter(
-                and_(
-                    Follow.user_being_followed_id==self.u3_id,
-                    Follow.user_following_id==self.u2_id)
-                ).count(),
-                0
-            )
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.u1_id
 
-    def test_follow_when_already_following(self):
-        ''' Tests a case where a user tries to follow someone they
-            already follow '''
+    response = client.get(users.u1_url)
 
-        with app.test_client() as c:
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.u1_id
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert '<h4 id="sidebar-username">@u1</h4>' in html
 
 
-            response = c.post(f'/users/follow/{self.u2_id}', headers={
-                    "referer" : "/"
-            })
+def test_users_search(client, users):
+    """Tests that user search matches usernames case-insensitively"""
 
-            response = c.post(f'/users/follow/{self.u2_id}', headers={
-                    "referer" : "/"
-            },follow_redirects=True)
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.u1_id
 
-            self.assertEqual(response.status_code,200)
-            html = response.get_data(as_text=True)
-
-            self.assertIn('<!-- HOMEPAGE :: FOR TESTING :: DO NOT MOVE -->',html)
-            self.assertIn("You are already following that user.",html)
-
-            self.assertIsNotNone(
-                Follow.query.filter(
-                    and_(Follow.user_being_followed_id==self.u2_id,
-                        Follow.user_following_id==self.u1_id)).one_or_none()
-            )
+    response = client.get("/users?q=unique_user")
 
-    def test_unfollow_when_not_following(self):
-        ''' Tests a case where a user tries to unfollow someone they
-            are not following '''
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert '@UNIQUE_USER_NAME_FOR_TEST' in html
+    assert '@u2' not in html
 
-        with app.test_client() as c:
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.u2_id
 
-            response = c.post(
-                f'/users/stop-following/{self.u3_id}',
-                headers={
-                    "referer" : "/"
-                },
-                follow_redirects=True
-            )
-
-            response = c.post(
-                f'/users/stop-following/{self.u3_id}',
-                headers={
-                    "referer" : "/"
-                },
-                follow_redirects=True
-            )
-
-            self.assertEqual(response.status_code,200)
-            html = response.get_data(as_text=True)
-
-            self.assertIn('<!-- HOMEPAGE :: FOR TESTING :: DO NOT MOVE -->',html)
-            self.assertIn("You are not following that user.",html)
-
-            self.assertEqual(
-                Follow.query.filter(
-                and_(
-                    Follow.user_being_followed_id==self.u3_id,
-                    Follow.user_following_id==self.u2_id)
-                ).count(),
-                0
-            )
-
-    def test_follower_page_updating(self):
-        ''' Tests that when a user follows someone, that user
-            shows up in the followed user's followers page'''
-        #TODO: consider combining these with above
-
-        with app.test_client() as c:
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.u1_id
-
-        response = c.post(f'/users/follow/{self.u2_id}', headers={
-                "referer" : "/"
-        })
-
-        response = c.get(f'/users/{self.u2_id}/followers')
-        html = response.get_data(as_text=True)
-        self.assertIn("u1",html)
-
-    def test_following_page_updating(self):
-        ''' Tests that when a user follows someone, that user
-            shows up in the user's following page'''
-
-        with app.test_client() as c:
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.u1_id
-
-        response = c.post(f'/users/follow/{self.u2_id}', headers={
-                "referer" : "/"
-        })
-
-        response = c.get(f'/users/{self.u1_id}/following')
-        html = response.get_data(as_text=True)
-        self.assertIn("u2",html)
-
-    def test_follower_page_updating_when_unfollowed(self):
-        ''' Tests that when a user unfollows someone, that user does not
-            show up in the followed user's followers page'''
-
-        with app.test_client() as c:
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.u4_id
-
-        response = c.post(f'/users/stop-following/{self.u3_id}')
-        response = c.get(f'/users/{self.u3_id}/followers')
-
-        html = response.get_data(as_text=True)
-        self.assertNotIn("<p>@UNIQUE_USER_NAME_FOR_TEST</p>",html)
-
-    def test_following_page_updating_when_unfollowed(self):
-        ''' Tests that when a user unfollows someone, that user does not
-            show up in the previously followed user's following page'''
-
-        with app.test_client() as c:
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.u3_id
-
-        response = c.post(f'/users/stop-following/{self.u4_id}')
-        response = c.get(f'/users/{self.u3_id}/following')
-
-        html = response.get_data(as_text=True)
-        self.assertNotIn("<p>@UNIQUE_USER_NAME_FOR_TEST</p>",html)
-
-class SignupTestCase(UserViewTestCase):
-    """Tests signup cases"""
-    #TODO: move up before Follow test cases.
-
-    def test_user_signup(self):
-        """Tests successful user signup"""
-
-        with app.test_client() as c:
-            user_count = User.query.count()
-
-            response = c.post(
-                "/signup",
-                data={
-                "username": "test_user",
-                "password": "password",
-                "email": "test_user@gmail.com",
-                },
-                follow_redirects=True
-            )
-
-            self.assertEqual(response.status_code, 200)
-            self.assertEqual(User.query.count(), user_count + 1)
-            self.assertEqual(
-                User.query.filter_by(email="test_user@gmail.com").count(),
-                1
-            )
-            #TODO: check for signed in version of home page
-
-    def test_user_signup_with_invalid_username(self):
-        """Tests user signup with already taken username"""
-
-        with app.test_client() as c:
-            user_count = User.query.count()
-
-            response = c.post(
-                "/signup",
-                data={
-                "username": "u1",
-                "password": "password",
-                "email": "another_test_email@gmail.com",
-                },
-                follow_redirects=True
-            )
-
-            html = response.get_data(as_text=True)
-            self.assertIn("Username or email already taken",html)
-            self.assertIn('<!-- SIGNUP PAGE :: FOR TESTING -->',html)
-            self.assertEqual(response.status_code, 200)
-
-            db.session.rollback()
-            self.assertEqual(User.query.count(), user_count)
-
-    def test_user_signup_with_invalid_email(self):
-        """Tests user signup with already taken email"""
-
-        with app.test_client() as c:
-            user_count = User.query.count()
-
-            response = c.post(
-                "/signup",
-                data={
-                "username": "test_user",
-                "password": "password",
-                "email": "u1@email.com",
-                },
-                follow_redirects=True
-            )
-
-            html = response.get_data(as_text=True)
-            self.assertIn("Username or email already taken",html)
-            self.assertIn('<!-- SIGNUP PAGE :: FOR TESTING -->',html)
-            self.assertEqual(response.status_code, 200)
-
-            db.session.rollback()
-            self.assertEqual(User.query.count(), user_count)
-
-    def test_user_signup_with_invalid_password(self):
-        """Tests user signup with invalid password"""
-
-        with app.test_client() as c:
-            user_count = User.query.count()
-
-            response = c.post(
-                "/signup",
-                data={
-                "username": "test_user",
-                "password": "pa",
-                "email": "another_test_email@email.com",
-                },
-                follow_redirects=True
-            )
-
-            html = response.get_data(as_text=True)
-            self.assertIn("Field must be between 6 and 50 characters long.",html)
-            self.assertIn('<!-- SIGNUP PAGE :: FOR TESTING -->',html)
-
-            self.assertEqual(response.status_code, 200)
-            db.session.rollback()
-            self.assertEqual(User.query.count(), user_count)
-
-    def test_user_signup_with_null_input(self):
-        """Tests user signup with null input"""
-
-        with app.test_client() as c:
-            user_count = User.query.count()
-
-            response = c.post(
-                "/signup",
-                data={
-                "username": None,
-                "password": "password",
-                "email": "another_test_email@email.com",
-                },
-                follow_redirects=True
-            )
+def test_users_list_follow_buttons(client, users):
+    """Tests that the users list offers unfollow only for followed users"""
 
-            html = response.get_data(as_text=True)
-            self.assertIn("This field is required.", html)
-            self.assertIn('<!-- SIGNUP PAGE :: FOR TESTING -->', html)
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.u2_id
 
-            self.assertEqual(response.status_code, 200)
-            db.session.rollback()
-            self.assertEqual(User.query.count(), user_count)
+    response = client.get("/users")
 
-class AuthorizationTestCase(UserViewTestCase):
-    """Tests access for both users and non-users """
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert f'action="{users.stop_following_u3_url}"' in html
+    assert f'action="/users/stop-following/{users.u1_id}"' not in html
+    assert f'action="/users/follow/{users.u1_id}"' in html
 
-    def test_root_route(self):
-        """Tests root route while logged in"""
 
-        with app.test_client() as c:
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.u1_id
+def test_users_page_while_logged_out(client, users):
+    """Tests showing users page while logged out"""
 
-            response = c.get("/")
+    response = client.get(users.u1_url, follow_redirects=True)
 
-            self.assertEqual(response.status_code, 200)
-            html = response.get_data(as_text=True)
-            self.assertIn('HOMEPAGE :: FOR TESTING :: DO NOT MOVE', html)
-            #TODO: check for username
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert 'Access unauthorized.' in html
 
-    def test_root_route_while_logged_out(self):
-        """Tests root route while logged out"""
 
-        with app.test_client() as c:
-            response = c.get("/")
+def test_view_followers_page(client, users):
+    ''' Tests visiting another users followers page'''
 
-            self.assertEqual(response.status_code, 200)
-            html = response.get_data(as_text=True)
-            self.assertIn('ANON-HOMEPAGE :: FOR TESTING :: DO NOT MOVE', html)
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.u1_id
 
-    def test_users_page(self):
-        """Tests showing user's page while logged in"""
-        #TODO: users_profile_page naming
+    response = client.get(users.u2_followers_url)
 
-        with app.test_client() as c:
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.u1_id
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
 
-            response = c.get(f"/users/{self.u1_id}")
+    assert 'Access unauthorized.' not in html
+    assert 'FOLLOWERS PAGE :: FOR TESTING' in html
 
-            self.assertEqual(response.status_code, 200)
-            html = response.get_data(as_text=True)
-            self.assertIn('<h4 id="sidebar-username">@u1</h4>', html)
 
-    def test_users_page_while_logged_out(self):
-        """Tests showing users page while logged out"""
+def test_view_following_page(client, users):
+    ''' Tests visiting another users following pages'''
 
-        with app.test_client() as c:
-            response = c.get(f"/users/{self.u1_id}", follow_redirects=True)
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.u1_id
 
-            self.assertEqual(response.status_code, 200)
-            html = response.get_data(as_text=True)
-            self.assertIn('Access unauthorized.', html)
+    response = client.get(users.u2_following_url)
 
-    def test_view_followers_page(self):
-        ''' Tests visiting another users followers page'''
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
 
-        with app.test_client() as c:
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.u1_id
+    assert 'Access unauthorized.' not in html
+    assert 'FOLLOWING PAGE :: FOR TESTING' in html
 
-            response = c.get(f"/users/{self.u2_id}/followers")
 
-            self.assertEqual(response.status_code, 200)
-            html = response.get_data(as_text=True)
+def test_view_followers_page_before_id(client, users):
+    ''' Tests that the followers page only lists followers with
+        ids below before_id'''
 
-            self.assertNotIn('Access unauthorized.', html)
-            self.assertIn('FOLLOWERS PAGE :: FOR TESTING', html)
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.u1_id
 
-    def test_view_following_page(self):
-        ''' Tests visiting another users following pages'''
+    response = client.get(f"{users.u3_followers_url}?before_id={users.u4_id}")
 
-        with app.test_client() as c:
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.u1_id
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
 
-            response = c.get(f"/users/{self.u2_id}/following")
+    assert '<p>@u2</p>' in html
+    assert '<p>@UNIQUE_USER_NAME_FOR_TEST</p>' not in html
 
-            self.assertEqual(response.status_code, 200)
-            html = response.get_data(as_text=True)
 
-            self.assertNotIn('Access unauthorized.', html)
-            self.assertIn('FOLLOWING PAGE :: FOR TESTING', html)
+def test_view_followers_page_when_logged_out(client, users):
+    ''' Tests visiting users followers page when logged out'''
 
-    def test_view_followers_page_when_logged_out(self):
-        ''' Tests visiting users followers page when logged out'''
+    response = client.get(users.u1_followers_url, follow_redirects=True)
 
-        with app.test_client() as c:
-            response = c.get(f"/users/{self.u1_id}/followers",
-                             follow_redirects=True)
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
 
-            self.assertEqual(response.status_code, 200)
-            html = response.get_data(as_text=True)
+    assert 'Access unauthorized.' in html
+    assert 'FOLLOWERS PAGE :: FOR TESTING' not in html
 
-            self.assertIn('Access unauthorized.', html)
-            self.assertNotIn('FOLLOWERS PAGE :: FOR TESTING', html)
 
-    def test_view_following_page_when_logged_out(self):
-        ''' Tests visiting users following pages when logged out'''
+def test_view_following_page_when_logged_out(client, users):
+    ''' Tests visiting users following pages when logged out'''
 
-        with app.test_client() as c:
-            response = c.get(f"/users/{self.u1_id}/following",
-                             follow_redirects=True)
+    response = client.get(users.u1_following_url, follow_redirects=True)
 
-            self.assertEqual(response.status_code, 200)
-            html = response.get_data(as_text=True)
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
 
-            self.assertIn('Access unauthorized.', html)
-            self.assertNotIn('FOLLOWING PAGE :: FOR TESTING', html)
+    assert 'Access unauthorized.' in html
+    assert 'FOLLOWING PAGE :: FOR TESTING' not in html
 
-#TODO: check someone elses like page if you're logged/not logged in
\ No newline at end of file
+#TODO: check someone elses like page if you're logged/not logged in
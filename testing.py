@@ -0,0 +1,49 @@
+"""Database helpers shared by the test modules."""
+
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from models import db
+
+_tables_created = False
+
+
+def create_tables():
+    """(Re)create the tables, unless this test run already has.
+
+    Called by each unittest module on import and by conftest's `schema`
+    fixture, so a run builds the schema once however many modules it has.
+    """
+
+    global _tables_created
+
+    if not _tables_created:
+        db.drop_all()
+        db.create_all()
+        _tables_created = True
+
+
+class RolledBackTransaction:
+    """Run tests inside one transaction, rolled back by `rollback()`.
+
+    db.session (used by both the tests and the app) is bound to this
+    transaction's connection, so its commits only release a SAVEPOINT
+    within it.
+    """
+
+    def __init__(self):
+        self.connection = db.engine.connect()
+        self.trans = self.connection.begin()
+
+        self.app_session = db.session
+        db.session = scoped_session(sessionmaker(
+            bind=self.connection,
+            join_transaction_mode="create_savepoint",
+        ))
+
+    def rollback(self):
+        """Undo everything done in the transaction and restore db.session."""
+
+        db.session.remove()
+        db.session = self.app_session
+        self.trans.rollback()
+        self.connection.close()